@@ -0,0 +1,288 @@
+"""Benchmarks for the hot paths of the treemap trees.
+
+Each fixture is built from a synthetic generator at several scales: a
+directory tree written to a temporary directory for FileSystemTree, or a
+papers CSV file for PaperTree. The operations the visualiser relies on are
+then timed on it, and the results are written out as JSON so that runs can
+be compared to track regressions.
+
+Run it with, for example:
+
+    python benchmarks.py --scales 1000 10000 --output bench.json
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree
+
+# The fixtures that can be benchmarked.
+FIXTURES = ('wide', 'deep', 'zipf', 'realistic', 'papers')
+
+# The scales (approximate number of leaves) used when none are given.
+DEFAULT_SCALES = (1000, 10000)
+
+# The rectangle used for every layout.
+RECT = (0, 0, 800, 570)
+
+# File extensions used by the 'realistic' fixture, with relative weights.
+_EXTENSIONS = [('.py', 20), ('.txt', 10), ('.md', 5), ('.json', 8),
+               ('.png', 6), ('.jpg', 6), ('.so', 2), ('.pdf', 3),
+               ('.csv', 4), ('', 3)]
+
+# How many times a single-node operation is repeated within one timing.
+_POINT_OPS = 1000
+
+
+def _make_file(path: str, size: int) -> None:
+    """Create a file at <path> whose reported size is <size> bytes.
+
+    The file is sparse, so large sizes cost no disk space.
+    """
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def generate_wide(root: str, n: int, rng: random.Random) -> None:
+    """Write <n> files directly inside the directory <root>."""
+    for i in range(n):
+        _make_file(os.path.join(root, 'f{}.dat'.format(i)),
+                   rng.randint(1, 10000))
+
+
+def generate_deep(root: str, n: int, rng: random.Random) -> None:
+    """Write <n> files spread along a single chain of nested directories
+    under <root>.
+
+    The chain is at most 200 directories deep, to stay well within Python's
+    recursion limit.
+    """
+    depth = max(1, min(200, n // 10))
+    path = root
+    for level in range(depth):
+        path = os.path.join(path, 'd{}'.format(level))
+        os.mkdir(path)
+        for i in range(n // depth):
+            _make_file(os.path.join(path, 'f{}.dat'.format(i)),
+                       rng.randint(1, 10000))
+
+
+def generate_zipf(root: str, n: int, rng: random.Random) -> None:
+    """Write <n> files under <root> in directories with fan-out 8, with file
+    sizes following a Zipf distribution.
+    """
+    dirs = [root]
+    for i in range(n):
+        if i % 8 == 0 and i > 0:
+            parent = dirs[rng.randrange(len(dirs))]
+            path = os.path.join(parent, 'd{}'.format(i))
+            os.mkdir(path)
+            dirs.append(path)
+        rank = i + 1
+        size = max(1, int(10 ** 7 / rank))
+        _make_file(os.path.join(dirs[rng.randrange(len(dirs))],
+                                'f{}.dat'.format(i)), size)
+
+
+def generate_realistic(root: str, n: int, rng: random.Random) -> None:
+    """Write <n> files under <root> shaped like a real project directory:
+    uneven fan-out, a mix of extensions and log-normal file sizes.
+    """
+    extensions = [ext for ext, weight in _EXTENSIONS for _ in range(weight)]
+    frontier = [(root, 0)]
+    written = 0
+    while written < n:
+        parent, depth = frontier[rng.randrange(len(frontier))]
+        if depth < 12 and rng.random() < 0.08:
+            path = os.path.join(parent, 'dir{}'.format(len(frontier)))
+            os.mkdir(path)
+            frontier.append((path, depth + 1))
+            continue
+        size = int(rng.lognormvariate(8, 2.5))
+        _make_file(os.path.join(parent, 'file{}{}'.format(
+            written, rng.choice(extensions))), size)
+        written += 1
+
+
+def generate_papers_csv(path: str, n: int, rng: random.Random) -> None:
+    """Write a papers dataset with <n> rows to the CSV file <path>, in the
+    format read by PaperTree.
+    """
+    categories = ['Cat{}'.format(i) for i in range(20)]
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['Author', 'Title', 'Year', 'Category', 'Url',
+                         'Citations'])
+        for i in range(n):
+            depth = rng.randint(1, 3)
+            category = ':'.join(rng.choice(categories) for _ in range(depth))
+            writer.writerow(['Author {}'.format(rng.randrange(n // 4 + 1)),
+                             'Paper {}'.format(i),
+                             str(rng.randint(1990, 2020)), category,
+                             'https://doi.org/10.0/{}'.format(i),
+                             str(int(rng.paretovariate(1.2)))])
+
+
+_GENERATORS = {
+    'wide': generate_wide,
+    'deep': generate_deep,
+    'zipf': generate_zipf,
+    'realistic': generate_realistic,
+}
+
+
+def _time(func: Callable[[], object], repeat: int) -> float:
+    """Return the fastest of <repeat> timings of calling <func>, in seconds.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _nodes(tree: TMTree) -> List[TMTree]:
+    """Return every node of <tree>, in preorder."""
+    lst = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        lst.append(node)
+        stack.extend(reversed(node._subtrees))
+    return lst
+
+
+def _build(fixture: str, directory: str, n: int,
+           rng: random.Random) -> Callable[[], TMTree]:
+    """Generate the data for <fixture> with scale <n> inside <directory>, and
+    return a function that builds a tree from it.
+    """
+    if fixture == 'papers':
+        path = os.path.join(directory, 'papers.csv')
+        generate_papers_csv(path, n, rng)
+        return lambda: PaperTree('CS1', [], all_papers=True, by_year=True,
+                                 data_file=path)
+
+    root = os.path.join(directory, 'root')
+    os.mkdir(root)
+    _GENERATORS[fixture](root, n, rng)
+    return lambda: FileSystemTree(root)
+
+
+def bench_fixture(fixture: str, n: int, repeat: int = 3,
+                  seed: int = 0) -> List[Dict]:
+    """Return the timings of every operation on <fixture> at scale <n>.
+
+    Each timing is the fastest of <repeat> runs. Operations on a single node
+    are timed over a batch of calls and reported per call. The papers fixture
+    also times regrouping the whole tree.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory(prefix='treemap-bench-') as directory:
+        build = _build(fixture, directory, n, rng)
+        timings = [('scan', _time(build, repeat))]
+        tree = build()
+        nodes = _nodes(tree)
+        leaves = [node for node in nodes if not node._subtrees]
+        internal = [node for node in nodes if node._subtrees]
+
+        timings.append(('update_data_sizes',
+                        _time(tree.update_data_sizes, repeat)))
+        timings.append(('update_rectangles',
+                        _time(lambda: tree.update_rectangles(RECT), repeat)))
+        timings.append(('get_rectangles_collapsed',
+                        _time(tree.get_rectangles, repeat)))
+        tree.expand_all()
+        timings.append(('get_rectangles_expanded',
+                        _time(tree.get_rectangles, repeat)))
+
+        points = [(rng.randrange(RECT[2]), rng.randrange(RECT[3]))
+                  for _ in range(_POINT_OPS)]
+
+        def hit_test() -> None:
+            for point in points:
+                tree.get_tree_at_position(point)
+        timings.append(('get_tree_at_position',
+                        _time(hit_test, repeat) / _POINT_OPS))
+
+        sample = [rng.choice(leaves) for _ in range(_POINT_OPS)]
+
+        def change_size() -> None:
+            for leaf in sample:
+                leaf.change_size(0.01)
+        timings.append(('change_size',
+                        _time(change_size, repeat) / _POINT_OPS))
+
+        moves = [(rng.choice(leaves), rng.choice(internal))
+                 for _ in range(_POINT_OPS)]
+
+        def move() -> None:
+            for leaf, destination in moves:
+                leaf.move(destination)
+        timings.append(('move', _time(move, 1) / _POINT_OPS))
+
+        if fixture == 'papers':
+            timings.append(('regroup', _time(
+                lambda: tree.regroup(['Author', 'Category']), repeat)))
+
+    return [{'fixture': fixture, 'scale': n, 'nodes': len(nodes),
+             'operation': operation, 'seconds': seconds}
+            for operation, seconds in timings]
+
+
+def run(fixtures: List[str], scales: List[int], repeat: int = 3,
+        seed: int = 0) -> Dict:
+    """Run the benchmarks for every fixture in <fixtures> at every scale in
+    <scales>, and return the results with a description of the environment.
+    """
+    results = []
+    for fixture in fixtures:
+        for n in scales:
+            results.extend(bench_fixture(fixture, n, repeat, seed))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmarks selected on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', nargs='+', choices=FIXTURES,
+                        default=list(FIXTURES))
+    parser.add_argument('--scales', nargs='+', type=int,
+                        default=list(DEFAULT_SCALES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the JSON results '
+                                         'to, instead of standard output')
+    args = parser.parse_args(argv)
+
+    report = run(args.fixtures, args.scales, args.repeat, args.seed)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for result in report['results']:
+            print('{fixture:>10} {scale:>8} {operation:>25} '
+                  '{seconds:.6f}s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
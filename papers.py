@@ -1,15 +1,109 @@
+from __future__ import annotations
 import csv
-from typing import List, Dict
+import gc
+import sys
+from array import array
+from typing import List, Optional, Tuple
 from tm_trees import TMTree
 
 # Filename for the dataset
 DATA_FILE = 'cs1_papers.csv'
 
+# The columns of the dataset that the paper tree can be grouped by.
+# A 'Category' such as 'a:b:c' gives one level per sub-category.
+GROUP_COLUMNS = ('Year', 'Category', 'Author')
+
+# Some useful orders of columns to group the paper tree by.
+GROUPINGS = [['Year', 'Category'], ['Category'], ['Author', 'Category']]
+
+
+class _PaperTable:
+    """The rows of the papers dataset, stored column by column.
+
+    Values that repeat across rows (years, authors and category names) are
+    interned, so each distinct value is stored only once.
+
+    === Public Attributes ===
+    titles, authors, urls, years:
+        The value of that column for each row.
+    categories:
+        The category of each row, split into its sub-categories.
+    citations:
+        The number of citations of each row.
+    leaves:
+        The leaf of the paper tree for each row, or [] until the tree is
+        first grouped. The leaves are kept so that regrouping only needs to
+        move them under new subtrees.
+
+    === Representation Invariants ===
+    - Every attribute other than leaves has one entry per row of the
+      dataset, and leaves has either one or none.
+    """
+    titles: List[str]
+    authors: List[str]
+    urls: List[str]
+    years: List[str]
+    categories: List[Tuple[str, ...]]
+    citations: array
+    leaves: List[PaperTree]
+
+    def __init__(self, path: str) -> None:
+        """Load the papers dataset from the CSV file <path>."""
+        self.titles = []
+        self.authors = []
+        self.urls = []
+        self.years = []
+        self.categories = []
+        self.citations = array('q')
+        self.leaves = []
+        intern = sys.intern
+        with open(path, mode='r') as csv_file:
+            for row in csv.DictReader(csv_file):
+                self.titles.append(row['Title'])
+                self.authors.append(intern(row['Author']))
+                self.urls.append(row['Url'])
+                self.years.append(intern(row['Year']))
+                self.categories.append(tuple(
+                    intern(name) for name in row['Category'].split(':')))
+                self.citations.append(int(row['Citations']))
+
+    def __len__(self) -> int:
+        """Return the number of rows in this table."""
+        return len(self.titles)
+
+    def get_paths(self, keys: List[str]) -> List[Tuple[str, ...]]:
+        """Return, for each row, the names of the subtrees leading to it when
+        grouping by the columns <keys> in order. If <keys> is empty, every
+        path is empty, so the papers are not grouped at all.
+
+        Precondition: every column in <keys> is in GROUP_COLUMNS.
+        """
+        columns = []
+        for key in keys:
+            if key == 'Year':
+                columns.append([(year,) for year in self.years])
+            elif key == 'Author':
+                columns.append([(author,) for author in self.authors])
+            else:
+                columns.append(self.categories)
+        if len(columns) == 0:
+            return [()] * len(self)
+        if len(columns) == 1:
+            return columns[0]
+        return [sum(parts, ()) for parts in zip(*columns)]
+
 
 class PaperTree(TMTree):
     """A tree representation of Computer Science Education research paper data.
 
     === Private Attributes ===
+    _table:
+        For the root of the whole paper tree, the rows of the dataset it was
+        built from, kept so that the tree can be regrouped without reloading
+        them; None for every other tree.
+    _grouping:
+        For the root of the whole paper tree, the columns it is currently
+        grouped by; [] for every other tree.
 
     These should store information about this paper's <authors> and <doi>.
 
@@ -20,7 +114,8 @@ class PaperTree(TMTree):
     data_size:
         The size of the data represented by this tree.
     _colour:
-        The RGB colour value of the root of this tree.
+        The packed RGB colour value of the root of this tree, or None if it
+        has not been computed yet.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -38,16 +133,19 @@ class PaperTree(TMTree):
     authors: str
     doi: str
     citations: int
+    _table: Optional[_PaperTable]
+    _grouping: List[str]
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False,
+                 data_file: Optional[str] = None) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
 
         If <all_papers> is True, then this tree is to be the root of the paper
-        tree. In that case, load data about papers from DATA_FILE to build the
-        tree.
+        tree. In that case, load data about papers from the CSV file
+        <data_file> to build the tree, or from DATA_FILE if it is None.
 
         If <all_papers> is False, Do NOT load new data.
 
@@ -58,9 +156,13 @@ class PaperTree(TMTree):
 
         TMTree.__init__(self, name, [], 0)
         self._parent_tree = None
+        self._table = None
+        self._grouping = []
         if all_papers:
             self._expanded = True
-            self._load_papers_to_dict(by_year)
+            self._table = _PaperTable(
+                DATA_FILE if data_file is None else data_file)
+            self.regroup(['Year', 'Category'] if by_year else ['Category'])
         else:
             self._expanded = False
             self.authors = authors
@@ -68,19 +170,93 @@ class PaperTree(TMTree):
             self.citations = citations
 
 
-    def _load_papers_to_dict(self, by_year: bool = True) -> None:
-        """Return a nested dictionary of the data read from the papers
-         dataset file.
+    def regroup(self, keys: List[str]) -> None:
+        """Rebuild the subtrees of this tree from the loaded dataset, grouping
+        the papers by the columns <keys> in order, e.g. ['Year', 'Category'].
 
-        If <by_year>, then use years as the roots of the subtrees of the root of
-        the whole tree. Otherwise, ignore years and use categories only.
+        The leaves for the papers are created only once, by the first call,
+        and are moved under the new subtrees on every later call. The rows
+        are grouped in a single pass, adding the citations of each row to
+        the size of every subtree on its path. Subtrees appear in the order
+        that they first appear in the dataset. Every subtree is collapsed.
+
+        Precondition: this tree is the root of the whole paper tree, and
+        every column in <keys> is in GROUP_COLUMNS.
         """
-        with open(DATA_FILE, mode='r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
+        if self._table is None:
+            raise ValueError('only the root of the paper tree can be '
+                             'regrouped')
+        for key in keys:
+            if key not in GROUP_COLUMNS:
+                raise ValueError('cannot group papers by {}'.format(key))
+
+        # Creating this many trees would otherwise set off repeated full
+        # collections over the whole tree, which take far longer than the
+        # grouping itself.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._release_subtrees()
+            self._group(keys)
+        finally:
+            if collecting:
+                gc.enable()
 
-            for row in csv_reader:
-                self._build_tree_from_dict(row, by_year)
+    def _release_subtrees(self) -> None:
+        """Unlink the subtrees of this tree from each other, so that the ones
+        that are not kept are freed as soon as they are dropped rather than
+        left for the garbage collector.
+        """
+        stack = list(self._subtrees)
+        while stack:
+            node = stack.pop()
+            if node._subtrees:
+                stack.extend(node._subtrees)
+                node._subtrees = []
 
+    def _group(self, keys: List[str]) -> None:
+        """Group the papers of this tree by the columns <keys>, as described
+        in regroup.
+        """
+        table = self._table
+        citations = table.citations
+        if table.leaves == []:
+            table.leaves = [PaperTree(table.titles[i], [], table.authors[i],
+                                      table.urls[i], citations[i], False,
+                                      False)
+                            for i in range(len(table))]
+        self._grouping = list(keys)
+
+        self._subtrees = []
+        self.data_size = sum(citations)
+        self._expanded = True
+        self._frontier = None
+        # name -> (subtree, the same mapping for the subtrees of that subtree)
+        groups = {}
+        for i, path in enumerate(table.get_paths(keys)):
+            size = citations[i]
+            parent, children = self, groups
+            for name in path:
+                group = children.get(name)
+                if group is None:
+                    sub_node = PaperTree(name, [], '', '', 0, False, False)
+                    sub_node._parent_tree = parent
+                    parent._subtrees.append(sub_node)
+                    group = children[name] = (sub_node, {})
+                parent, children = group
+                parent.data_size += size
+            leaf = table.leaves[i]
+            leaf._parent_tree = parent
+            leaf.data_size = size
+            leaf._expanded = False
+            leaf._colour = None
+            parent._subtrees.append(leaf)
+
+    def get_grouping(self) -> List[str]:
+        """Return the columns that this tree was last grouped by with regroup,
+        or [] if it is not the root of the whole paper tree.
+        """
+        return list(self._grouping)
 
     def get_separator(self) -> str:
         """Return the file separator for this OS.
@@ -95,81 +271,21 @@ class PaperTree(TMTree):
         else:
             return ' (Category)'
 
-    def _build_tree_from_dict(self, row: Dict, by_year: bool) -> None:
-        """Return a list of trees from the nested dictionary <nested_dict>.
-        """
-        category = row["Category"]
-        categories = category.split(':')
-        title = row["Title"]
-        url = row["Url"]
-        citation = int(row["Citations"])
-        author = row["Author"]
-        year = row["Year"]
-
-        parent = self
-        parent.data_size += citation
-        if by_year:
-            sub_node = self._build_sub_node([parent], year, citation)
-            parent = sub_node[0]
-
-        for item in categories:
-            sub_node = self._build_sub_node([parent], item, citation)
-            parent = sub_node[0]
-        leaf = PaperTree(title, [], author, url, citation, False, False)
-        leaf._parent_tree = parent
-        leaf.data_size = citation
-        parent._hacky([leaf])
-
-    def _hacky(self, leaf: List) -> List:
-        """
-        This is one of 3 hacky type methods that builds leaves
-        :param leaf: the leaf
-        :return: a list of leaves
+    def _get_category(self) -> str:
+        """Return the name of the category this paper is filed under, or the
+        name of this category.
         """
-        self._append_subnode(leaf[0])
-
-    def _build_sub_node(self, parent2: List, name: str, citation: int) -> List:
-        """
-        This is for building the sub nodes of the trees
-        :param parent2: a list of parents
-        :param name: the name of the category
-        :param citation: the citation
-        :return: A list of PaperTrees
-        """
-        parent = parent2[0]
-        sub_node2 = parent._hacky2(name)
-        self._expanded = self._expanded
-        if len(sub_node2) == 0:
-            sub_node = None
-        else:
-            sub_node = sub_node2[0]
-
-        if sub_node is None:
-            sub_node = PaperTree(name, [], "", "", 0, False, False)
-            sub_node._parent_tree = parent
-            parent._hacky3([sub_node])
-        sub_node.data_size += citation
-        return [sub_node]
-
-    def _hacky2(self, name: str) -> List:
-        """
-        This is the second of three methods that builds the tree
-        :param name: This is the name of the category
-        :return: A list of leaves
-        """
-        lst = []
-        abc = self._get_subnode_by_name(name)
-        lst.append(abc)
-        return lst
-
-    def _hacky3(self, sub_node: List) -> None:
-        """
-        This is the third of 3 methods that build the tree
-        :param sub_node: a subnode that will be appended
-        :return: Nothing
-        """
-        self._append_subnode(sub_node[0])
-
+        if len(self._subtrees) == 0 and self._parent_tree is not None:
+            return self._parent_tree._name
+        return self._name
 
 
 if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', '__future__', 'csv', 'gc', 'sys', 'array',
+            'tm_trees'
+        ],
+        'allowed-io': ['_PaperTable.__init__']
+    })
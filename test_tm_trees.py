@@ -0,0 +1,134 @@
+"""Tests for the visible frontier kept by the root of a TMTree.
+
+The root draws its frontier instead of scanning the tree, so these tests
+compare it against the original recursive definition of the displayed
+leaves after random sequences of expand, collapse and move.
+"""
+import os
+import random
+from typing import List, Set, Tuple
+
+import pytest
+
+from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree
+
+RECT = (0, 0, 800, 570)
+
+
+def _nodes(tree: TMTree) -> List[TMTree]:
+    """Return every node of <tree>, in preorder."""
+    lst = [tree]
+    for subtree in tree._subtrees:
+        lst.extend(_nodes(subtree))
+    return lst
+
+
+def _expected_rectangles(tree: TMTree) -> List[Tuple[int, int, int, int]]:
+    """Return the rectangles of the displayed-tree rooted at <tree>, found by
+    scanning every node as get_rectangles originally did.
+    """
+    if tree._subtrees == []:
+        return [tree.rect] if tree._expanded else []
+    lst = []
+    for subtree in tree._subtrees:
+        lst.extend(_expected_rectangles(subtree))
+    if lst == [] and tree._expanded:
+        lst.append(tree.rect)
+    return lst
+
+
+def _expected_frontier(tree: TMTree) -> Set[TMTree]:
+    """Return the trees that should be in the frontier of <tree>."""
+    return {node for node in _nodes(tree) if node._expanded and
+            not any(subtree._expanded for subtree in node._subtrees)}
+
+
+def _check(tree: TMTree) -> None:
+    """Check that the frontier of <tree> agrees with a full scan."""
+    tree.update_rectangles(RECT)
+    assert set(tree._get_frontier()) == _expected_frontier(tree)
+    assert sorted(rect for rect, _ in tree.get_rectangles()) == \
+        sorted(_expected_rectangles(tree))
+    for node in _nodes(tree)[1:]:
+        if node._expanded:
+            assert sorted(rect for rect, _ in node.get_rectangles()) == \
+                sorted(_expected_rectangles(node))
+
+
+def _make_dirs(path: str, rng: random.Random, depth: int = 0) -> None:
+    """Write a random directory tree at <path>."""
+    os.mkdir(path)
+    for i in range(rng.randint(1, 5)):
+        subitem = os.path.join(path, 'n{}'.format(i))
+        if depth < 4 and rng.random() < 0.5:
+            _make_dirs(subitem, rng, depth + 1)
+        else:
+            with open(subitem, 'wb') as f:
+                f.truncate(rng.randint(1, 1000))
+
+
+@pytest.fixture(scope='module')
+def tree_path(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp('frontier') / 'root')
+    _make_dirs(path, random.Random(148))
+    return path
+
+
+def test_initial_frontier_is_root(tree_path: str) -> None:
+    tree = FileSystemTree(tree_path)
+    tree.update_rectangles(RECT)
+    assert tree.get_rectangles() == [(tree.rect, tree._get_colour())]
+    _check(tree)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_frontier_matches_scan(tree_path: str, seed: int) -> None:
+    rng = random.Random(seed)
+    tree = FileSystemTree(tree_path)
+    for _ in range(150):
+        nodes = _nodes(tree)
+        node = rng.choice(nodes)
+        op = rng.choice(['expand', 'expand_all', 'collapse', 'collapse_all',
+                         'move'])
+        if op == 'move':
+            node.move(rng.choice(nodes))
+            tree.update_data_sizes()
+        else:
+            getattr(node, op)()
+        _check(tree)
+
+
+def test_collapse_all_leaves_only_root(tree_path: str) -> None:
+    tree = FileSystemTree(tree_path)
+    tree.expand_all()
+    leaf = [node for node in _nodes(tree) if node._subtrees == []][-1]
+    leaf.collapse_all()
+    assert list(tree._get_frontier()) == [tree]
+    _check(tree)
+
+
+def _shape(tree: TMTree) -> List[Tuple]:
+    """Return the names, sizes and nesting of <tree>, in preorder."""
+    return [(node._name, node.data_size, node._parent_tree is None or
+             node._parent_tree._name) for node in _nodes(tree)]
+
+
+def test_regroup_reuses_leaves(tmp_path) -> None:
+    path = str(tmp_path / 'papers.csv')
+    with open(path, 'w') as f:
+        f.write('Author,Title,Year,Category,Url,Citations\n'
+                'A,P0,2001,x:y,u0,3\nB,P1,2002,x,u1,5\n'
+                'A,P2,2001,z,u2,7\nC,P3,2001,x:y,u3,11\n')
+    tree = PaperTree('CS1', [], all_papers=True, data_file=path)
+    leaves = {id(node) for node in _nodes(tree) if node._subtrees == []}
+    tree.expand_all()
+    tree.regroup(['Author', 'Category'])
+    assert [(node._name, node.data_size) for node in tree._subtrees] == \
+        [('A', 10), ('B', 5), ('C', 11)]
+    tree.regroup(['Year', 'Category'])
+    assert {id(node) for node in _nodes(tree)
+            if node._subtrees == []} == leaves
+    assert _shape(tree) == _shape(PaperTree('CS1', [], all_papers=True,
+                                            data_file=path))
+    assert tree._get_frontier() == {tree: None}
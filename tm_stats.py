@@ -0,0 +1,170 @@
+"""Opt-in instrumentation for the treemap trees and visualiser.
+
+Instrumentation is off by default. While it is off, timer returns a shared
+no-op context manager, and the per-node counters in tm_trees are not
+installed at all (see on_toggle), so the cost is close to zero.
+
+Once enabled, this module collects:
+    - per-phase timers: call count, total and worst time of each phase
+    - counters: e.g. nodes visited by each tree operation, or files and
+      folders scanned
+    - a histogram of frame times
+
+snapshot returns all of these as a dict, and dump_json writes them to a file.
+"""
+from __future__ import annotations
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, Iterator, List, \
+    Optional
+
+# Whether statistics are being collected.
+enabled = False
+
+# The upper bounds, in milliseconds, of the frame-time histogram buckets.
+# The last bucket holds every frame slower than the final bound.
+FRAME_BUCKETS_MS = (4, 8, 16, 33, 50, 100, 250)
+
+# phase name -> [number of calls, total seconds, worst seconds]
+_timers: Dict[str, List[float]] = {}
+# counter name -> count
+_counters: Dict[str, int] = {}
+# one count per bucket of FRAME_BUCKETS_MS, plus one for slower frames
+_frames: List[int] = [0] * (len(FRAME_BUCKETS_MS) + 1)
+
+# functions to call with the new value of <enabled> whenever it changes
+_listeners: List[Callable[[bool], None]] = []
+
+_NULL_TIMER = nullcontext()
+
+
+def enable(on: bool = True) -> None:
+    """Start collecting statistics, or stop if <on> is False.
+
+    Statistics already collected are kept.
+    """
+    global enabled
+    if on == enabled:
+        return
+    enabled = on
+    for listener in _listeners:
+        listener(on)
+
+
+def on_toggle(listener: Callable[[bool], None]) -> None:
+    """Call <listener> with the value of <enabled> now and whenever it
+    changes, so that code too hot to check <enabled> on every call can be
+    swapped for a counting version only while statistics are collected.
+    """
+    _listeners.append(listener)
+    listener(enabled)
+
+
+def reset() -> None:
+    """Discard every statistic collected so far."""
+    _timers.clear()
+    _counters.clear()
+    _frames[:] = [0] * len(_frames)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add <n> to the counter <name>.
+
+    Callers on hot paths should check <enabled> first.
+    """
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def timer(phase: str) -> ContextManager[None]:
+    """Return a context manager that adds the time spent in its body to the
+    timer for <phase>, or does nothing if statistics are not enabled.
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return _timed(phase)
+
+
+@contextmanager
+def _timed(phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_time(phase, time.perf_counter() - start)
+
+
+def _add_time(phase: str, seconds: float) -> None:
+    entry = _timers.setdefault(phase, [0, 0.0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] = max(entry[2], seconds)
+
+
+def record_frame(seconds: float) -> None:
+    """Add a frame that took <seconds> to the frame-time histogram and to
+    the 'frame' timer.
+    """
+    if not enabled:
+        return
+    _add_time('frame', seconds)
+    ms = seconds * 1000
+    for i, bound in enumerate(FRAME_BUCKETS_MS):
+        if ms <= bound:
+            _frames[i] += 1
+            return
+    _frames[-1] += 1
+
+
+def snapshot() -> Dict:
+    """Return every statistic collected so far as a JSON-compatible dict.
+
+    Scan rates are derived from the 'scan' timer and the 'scan.*' counters.
+    """
+    timers = {phase: {'calls': int(calls), 'total_s': total,
+                      'mean_s': total / calls if calls else 0.0,
+                      'max_s': worst}
+              for phase, (calls, total, worst) in _timers.items()}
+    labels = ['<={}ms'.format(bound) for bound in FRAME_BUCKETS_MS]
+    labels.append('>{}ms'.format(FRAME_BUCKETS_MS[-1]))
+    result = {
+        'enabled': enabled,
+        'timers': timers,
+        'counters': dict(_counters),
+        'frames': dict(zip(labels, _frames)),
+    }
+    scan = _timers.get('scan')
+    if scan is not None and scan[1] > 0:
+        result['scan'] = {
+            'dirs_per_s': _counters.get('scan.dirs', 0) / scan[1],
+            'stats_per_s': _counters.get('scan.files', 0) / scan[1],
+            'errors': _counters.get('scan.errors', 0),
+        }
+    return result
+
+
+def dump_json(path: str) -> None:
+    """Write the statistics returned by snapshot to the file <path>."""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def overlay_lines(phases: Optional[List[str]] = None) -> List[str]:
+    """Return a short text summary of the statistics, one line per phase
+    in <phases> (or every phase, if None), for display on screen.
+    """
+    lines = []
+    for phase in (phases if phases is not None else sorted(_timers)):
+        if phase in _timers:
+            calls, total, worst = _timers[phase]
+            lines.append('{:<10} {:7.2f}ms avg {:7.2f}ms max'.format(
+                phase, total / calls * 1000, worst * 1000))
+    visits = sorted((name, n) for name, n in _counters.items()
+                    if name.startswith('visits.'))
+    for name, n in visits:
+        lines.append('{:<28} {}'.format(name, n))
+    total_frames = sum(_frames)
+    if total_frames:
+        slow = total_frames - sum(_frames[:FRAME_BUCKETS_MS.index(16) + 1])
+        lines.append('frames {}  over 16ms {}'.format(total_frames, slow))
+    return lines
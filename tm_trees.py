@@ -1,8 +1,80 @@
 from __future__ import annotations
 import os
 import math
-from random import randint
-from typing import List, Tuple, Optional
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, \
+    Tuple, Optional
+import tm_stats
+
+# The colour schemes that may be passed to set_colour_scheme.
+#   'path':     a colour derived from a hash of the tree's path, so that
+#               the same file or category is drawn the same way on every run
+#   'category': a palette colour chosen by the tree's category, e.g. the
+#               extension of a file or the sub-category of a paper
+#   'depth':    a palette colour chosen by the tree's depth below the root
+COLOUR_SCHEMES = ('path', 'category', 'depth')
+
+# The colour scheme used by set_growth_colours: red for trees that grew and
+# blue for trees that shrank since an earlier snapshot. It is not in
+# COLOUR_SCHEMES, since it needs the deltas recorded by set_growth_colours.
+GROWTH_SCHEME = 'growth'
+
+# The palette used by the 'category' and 'depth' colour schemes.
+PALETTE = [(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40),
+           (148, 103, 189), (140, 86, 75), (227, 119, 194), (127, 127, 127),
+           (188, 189, 34), (23, 190, 207), (174, 199, 232), (255, 187, 120)]
+
+# The active colour scheme, and a counter that is bumped whenever it changes
+# so that colours cached under an older scheme get recomputed.
+_colour_scheme = 'path'
+_colour_epoch = 0
+
+# The colours used by the 'growth' colour scheme.
+UNCHANGED_COLOUR = (128, 128, 128)
+GROWN_COLOUR = (220, 40, 40)
+SHRUNK_COLOUR = (40, 90, 220)
+
+# The data for the 'growth' colour scheme: the size delta of every tree that
+# was compared by diff_trees, the roots of added subtrees, and the largest
+# absolute delta, which the colours are scaled against.
+_growth: Dict[TMTree, int] = {}
+_growth_added: Set[TMTree] = set()
+_growth_scale = 0
+
+
+def set_colour_scheme(scheme: str) -> None:
+    """Use the colour scheme named <scheme> to colour every tree.
+
+    Colours are computed lazily, the next time each tree is drawn. Leaving
+    the growth colour scheme discards the deltas recorded for it.
+
+    Precondition: <scheme> is in COLOUR_SCHEMES.
+    """
+    if scheme not in COLOUR_SCHEMES:
+        raise ValueError('unknown colour scheme: {}'.format(scheme))
+    _clear_growth()
+    _use_colour_scheme(scheme)
+
+
+def _use_colour_scheme(scheme: str) -> None:
+    """Make <scheme> the active colour scheme, invalidating cached colours.
+    """
+    global _colour_scheme, _colour_epoch
+    _colour_scheme = scheme
+    _colour_epoch += 1
+
+
+def _clear_growth() -> None:
+    """Discard the deltas recorded by set_growth_colours."""
+    global _growth_scale
+    _growth.clear()
+    _growth_added.clear()
+    _growth_scale = 0
+
+
+def get_colour_scheme() -> str:
+    """Return the name of the active colour scheme."""
+    return _colour_scheme
 
 
 class TMTree:
@@ -27,7 +99,9 @@ class TMTree:
 
     === Private Attributes ===
     _colour:
-        The RGB colour value of the root of this tree.
+        The RGB colour value of the root of this tree, packed into a single
+        int as 0xRRGGBB with the colour epoch it was computed under in the
+        bits above, or None if it has not been computed yet.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -37,13 +111,18 @@ class TMTree:
         as a subtree, or None if this tree is not part of a larger tree.
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+    _frontier:
+        For the root of a tree, the trees currently drawn by get_rectangles
+        (the expanded trees none of whose subtrees are expanded), kept as the
+        keys of a dict in the order they became visible. None until the root
+        first needs it, and always None for trees that are not a root.
 
     === Representation Invariants ===
     - data_size >= 0
     - If _subtrees is not empty, then data_size is equal to the sum of the
       data_size of each subtree.
 
-    - _colour's elements are each in the range 0-255.
+    - if _colour is not None, then _colour >= 0
 
     - If _name is None, then _subtrees is empty, _parent_tree is None, and
       data_size is 0.
@@ -55,19 +134,24 @@ class TMTree:
     - if _expanded is False, then _expanded is False for every tree
       in _subtrees
     - if _subtrees is empty, then _expanded is False
+    - if _frontier is not None, then _parent_tree is None
     """
 
     rect: Tuple[int, int, int, int]
     data_size: int
-    _colour: Tuple[int, int, int]
+    _colour: Optional[int]
     _name: str
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _frontier: Optional[Dict[TMTree, None]]
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
-        """Initialize a new TMTree with a random colour and the provided <name>.
+        """Initialize a new TMTree with the provided <name>.
+
+        The colour of this tree is not chosen here: it is computed from the
+        active colour scheme the first time this tree is drawn.
 
         If <subtrees> is empty, use <data_size> to initialize this tree's
         data_size.
@@ -83,7 +167,8 @@ class TMTree:
         self._subtrees = subtrees
         self.data_size = data_size
         self.rect = (0, 0, 0, 0)
-        self._colour = (randint(0, 255), randint(0, 255), randint(0, 255))
+        self._colour = None
+        self._frontier = None
 
 
     def is_empty(self) -> bool:
@@ -91,6 +176,12 @@ class TMTree:
         """
         return self._name is None
 
+    def is_expanded(self) -> bool:
+        """Return True iff this tree is part of the displayed-tree, i.e. it
+        is drawn or one of its descendants is.
+        """
+        return self._expanded
+
     def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
@@ -150,18 +241,132 @@ class TMTree:
         rooted at this tree. Each tuple consists of a tuple that defines the
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
+
+        The leaves are read from the frontier kept by the root, so only the
+        trees currently drawn are visited, not every descendant.
         """
-        if self._subtrees == []:
-            if self._expanded:
-                return [(self.rect, self._colour)]
-            else:
-                return []
-        lst = []
-        for subtree in self._subtrees:
-            lst.extend(subtree.get_rectangles())
-        if lst == [] and self._expanded:
-            lst.extend([(self.rect, self._colour)])
-        return lst
+        if not self._expanded:
+            return []
+        frontier = self._get_frontier()
+        if tm_stats.enabled:
+            tm_stats.count('visits.get_rectangles', len(frontier))
+        if self._parent_tree is None:
+            return [(node.rect, node._get_colour()) for node in frontier]
+        return [(node.rect, node._get_colour()) for node in frontier
+                if node._is_within(self)]
+
+    def _is_within(self, tree: TMTree) -> bool:
+        """Return True iff this tree is <tree> or one of its descendants.
+        """
+        node = self
+        while node is not None:
+            if node is tree:
+                return True
+            node = node._parent_tree
+        return False
+
+    def _get_frontier(self) -> Dict[TMTree, None]:
+        """Return the visible frontier of the tree containing this tree,
+        building it with one full scan if the root has not needed it before.
+        """
+        root = self._get_top()
+        if root._frontier is None:
+            root._frontier = {}
+            stack = [root]
+            visits = 0
+            while stack:
+                node = stack.pop()
+                visits += 1
+                if not node._expanded:
+                    continue
+                if any(subtree._expanded for subtree in node._subtrees):
+                    stack.extend(reversed(node._subtrees))
+                else:
+                    root._frontier[node] = None
+            if tm_stats.enabled:
+                tm_stats.count('visits.frontier_build', visits)
+        return root._frontier
+
+    def _refresh_frontier(self, frontier: Dict[TMTree, None]) -> None:
+        """Add this tree to or remove it from <frontier>, according to
+        whether it is now drawn.
+        """
+        if self._expanded and \
+                not any(subtree._expanded for subtree in self._subtrees):
+            frontier[self] = None
+        else:
+            frontier.pop(self, None)
+
+    def _show(self, frontier: Dict[TMTree, None]) -> None:
+        """Mark this unexpanded tree as expanded, and move the frontier down
+        from its parent to it.
+        """
+        if self._expanded:
+            return
+        self._expanded = True
+        frontier[self] = None
+        if self._parent_tree is not None:
+            frontier.pop(self._parent_tree, None)
+
+    def _get_colour(self) -> Tuple[int, int, int]:
+        """Return the RGB colour of this tree under the active colour scheme,
+        computing and caching it if needed.
+        """
+        packed = self._colour
+        if packed is None or packed >> 24 != _colour_epoch:
+            packed = (_colour_epoch << 24) | self._compute_colour()
+            self._colour = packed
+        return (packed >> 16) & 255, (packed >> 8) & 255, packed & 255
+
+    def _compute_colour(self) -> int:
+        """Return the colour of this tree under the active colour scheme,
+        packed as 0xRRGGBB.
+        """
+        if _colour_scheme == 'path':
+            path = self.get_path_string(False)
+            return zlib.crc32(path.encode('utf-8', 'surrogateescape')) \
+                & 0xFFFFFF
+        if _colour_scheme == GROWTH_SCHEME:
+            r, g, b = _growth_colour(self._get_growth())
+        elif _colour_scheme == 'category':
+            key = self._get_category().encode('utf-8', 'surrogateescape')
+            r, g, b = PALETTE[zlib.crc32(key) % len(PALETTE)]
+        else:
+            r, g, b = PALETTE[self._get_depth() % len(PALETTE)]
+        return (r << 16) | (g << 8) | b
+
+    def _get_growth(self) -> int:
+        """Return the change in this tree's size recorded by
+        set_growth_colours.
+
+        Every tree that diff_trees compared is recorded, but it does not
+        descend into unchanged or added subtrees, so only their roots are.
+        Otherwise, look for the nearest recorded ancestor: every tree in an
+        added subtree is new, and every tree in an unchanged one kept its size.
+        """
+        node = self
+        while node is not None and node not in _growth:
+            node = node._parent_tree
+        if node is self:
+            return _growth[self]
+        if node is not None and node in _growth_added:
+            return self.data_size
+        return 0
+
+    def _get_category(self) -> str:
+        """Return the key used to pick this tree's colour under the
+        'category' colour scheme.
+        """
+        return self._name
+
+    def _get_depth(self) -> int:
+        """Return the number of ancestors of this tree."""
+        depth = 0
+        node = self._parent_tree
+        while node is not None:
+            depth += 1
+            node = node._parent_tree
+        return depth
 
     def _get_subtrees(self) -> List[TMTree]:
         lst = []
@@ -206,10 +411,35 @@ class TMTree:
             return lst[0]
         elif len(lst) > 1:
             return _the_one(lst)
-        if len(self.get_rectangles()) == 1:
+        if self in self._get_frontier() or len(self.get_rectangles()) == 1:
             return self
         return None
 
+    def get_layout(self) -> List[Tuple[int, int, int, int]]:
+        """Return the rectangles of this tree and its descendants, in
+        preorder, so that they can be restored later with set_layout.
+        """
+        layout = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            layout.append(node.rect)
+            stack.extend(reversed(node._subtrees))
+        return layout
+
+    def set_layout(self, layout: List[Tuple[int, int, int, int]]) -> None:
+        """Restore the rectangles of this tree and its descendants from
+        <layout>, as returned by get_layout.
+
+        Precondition: the shape of this tree has not changed since <layout>
+        was returned by get_layout.
+        """
+        stack = [self]
+        for rect in layout:
+            node = stack.pop()
+            node.rect = rect
+            stack.extend(reversed(node._subtrees))
+
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
         size of their leaves, and return the new size.
@@ -230,12 +460,19 @@ class TMTree:
         tree to be the last subtree of <destination>. Otherwise, do nothing.
         """
         if self._subtrees == [] and destination._subtrees != []:
-            self._parent_tree.data_size -= self.data_size
+            frontier = self._get_frontier()
+            source = self._parent_tree
+            source.data_size -= self.data_size
             destination._subtrees.append(self)
             destination.data_size += self.data_size
-            self._parent_tree._subtrees.remove(self)
+            source._subtrees.remove(self)
             self._parent_tree = destination
             self._expanded = False
+            # the colour may depend on the path or depth, which just changed
+            self._colour = None
+            frontier.pop(self, None)
+            source._refresh_frontier(frontier)
+            destination._refresh_frontier(frontier)
 
     def change_size(self, factor: float) -> None:
         """Change the value of this tree's data_size attribute by <factor>.
@@ -262,29 +499,42 @@ class TMTree:
 
     def expand(self) -> None:
         """Update attribute _expanded of internal node to True"""
-        self._expanded = True
+        frontier = self._get_frontier()
+        self._show(frontier)
         for subtree in self._subtrees:
-            subtree._expanded = True
+            subtree._show(frontier)
 
     def expand_all(self) -> None:
         """Update the entire displayed-tree rooted such that it is entirely
         expanded."""
-        self._expanded = True
-        # self.expand()
+        self._expand_all(self._get_frontier())
+
+    def _expand_all(self, frontier: Dict[TMTree, None]) -> None:
+        self._show(frontier)
         for subtree in self._subtrees:
-            subtree.expand_all()
+            subtree._expand_all(frontier)
 
     def collapse(self) -> None:
         """Update attribute _expanded to False"""
         if self._parent_tree is None:
             return
-        self._parent_tree._unexpand()
-        self._parent_tree._expanded = True
+        frontier = self._get_frontier()
+        self._parent_tree._unexpand(frontier)
+        self._parent_tree._show(frontier)
 
-    def _unexpand(self) -> None:
+    def _unexpand(self, frontier: Dict[TMTree, None]) -> None:
+        """Mark this tree and its descendants as unexpanded, removing them
+        from <frontier>.
+
+        Only expanded trees are visited: by the representation invariants, the
+        descendants of an unexpanded tree are already unexpanded.
+        """
+        if not self._expanded:
+            return
         self._expanded = False
+        frontier.pop(self, None)
         for subtree in self._subtrees:
-            subtree._unexpand()
+            subtree._unexpand(frontier)
 
     def collapse_all(self) -> None:
         """Update every attribute _expanded in displayed-tree rooted to False
@@ -325,14 +575,41 @@ class TMTree:
         """
         raise NotImplementedError
 
-    def _get_subnode_by_name(self, name: str) -> TMTree:
-        for subtree in self._subtrees:
-            if subtree._name == name:
-                return subtree
-        return None
 
-    def _append_subnode(self, node: TMTree) -> None:
-        self._subtrees.extend([node])
+# The recursive TMTree methods that are replaced, while instrumentation is
+# enabled, by versions that count every call in the given tm_stats counter.
+_COUNTED_METHODS = {
+    'update_rectangles': 'visits.update_rectangles',
+    'get_tree_at_position': 'visits.get_tree_at_position',
+    'update_data_sizes': 'visits.update_data_sizes',
+    '_expand_all': 'visits.expand_all',
+    '_unexpand': 'visits.collapse',
+}
+_PLAIN_METHODS = {name: TMTree.__dict__[name] for name in _COUNTED_METHODS}
+
+
+def _counting(method: Callable, counter: str) -> Callable:
+    """Return a version of <method> that adds one to the tm_stats counter
+    <counter> each time it is called.
+    """
+    def counted(self: TMTree, *args: Any) -> Any:
+        tm_stats.count(counter)
+        return method(self, *args)
+    counted.__name__ = method.__name__
+    counted.__doc__ = method.__doc__
+    return counted
+
+
+def _set_counting(on: bool) -> None:
+    """Install the counting versions of the methods in _COUNTED_METHODS if
+    <on>, or the plain ones otherwise.
+    """
+    for name, counter in _COUNTED_METHODS.items():
+        method = _PLAIN_METHODS[name]
+        setattr(TMTree, name, _counting(method, counter) if on else method)
+
+
+tm_stats.on_toggle(_set_counting)
 
 
 def _the_one(lst: List) -> TMTree:
@@ -351,6 +628,32 @@ def _the_one(lst: List) -> TMTree:
     else:
         return lst[1]
 
+
+def _growth_colour(delta: int) -> Tuple[int, int, int]:
+    """Return the colour for a tree whose size changed by <delta>, shaded
+    between UNCHANGED_COLOUR and GROWN_COLOUR or SHRUNK_COLOUR on a log scale
+    relative to the largest change.
+    """
+    if delta == 0 or _growth_scale == 0:
+        return UNCHANGED_COLOUR
+    target = GROWN_COLOUR if delta > 0 else SHRUNK_COLOUR
+    t = math.log1p(abs(delta)) / math.log1p(_growth_scale)
+    return tuple(int(a + (b - a) * t)
+                 for a, b in zip(UNCHANGED_COLOUR, target))
+
+
+def _scan(func: Callable, path: str, default: Any) -> Any:
+    """Return func(<path>), or <default> if it raises an OSError, which is
+    counted as a scan error.
+    """
+    try:
+        return func(path)
+    except OSError:
+        if tm_stats.enabled:
+            tm_stats.count('scan.errors')
+        return default
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -362,6 +665,9 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
+
+    Files whose size cannot be read, such as broken symbolic links, have
+    size 0, and folders that cannot be listed are treated as empty.
     """
 
     def __init__(self, path: str) -> None:
@@ -372,14 +678,18 @@ class FileSystemTree(TMTree):
         TMTree.__init__(self, os.path.basename(path), [], 0)
         self._name = os.path.basename(path)
         if os.path.isdir(path):
+            if tm_stats.enabled:
+                tm_stats.count('scan.dirs')
             self._subtrees = self._build_children(path)
             sums = 0
             for subtree in self._subtrees:
                 sums += subtree.data_size
             self.data_size = sums
         else:
+            if tm_stats.enabled:
+                tm_stats.count('scan.files')
             self._subtrees = []
-            self.data_size = os.path.getsize(path)
+            self.data_size = _scan(os.path.getsize, path, 0)
 
         self._parent_tree = None
 
@@ -395,7 +705,7 @@ class FileSystemTree(TMTree):
         :return: a list of TMTrees
         """
         lst = []
-        for filename in os.listdir(path):
+        for filename in _scan(os.listdir, path, []):
             subitem = os.path.join(path, filename)
             thing = FileSystemTree(subitem)
             thing._parent_tree = self
@@ -419,5 +729,128 @@ class FileSystemTree(TMTree):
         else:
             return ' (folder)'
 
+    def _get_category(self) -> str:
+        """Return the extension of this file, or '' for a folder.
+        """
+        if len(self._subtrees) == 0:
+            return os.path.splitext(self._name)[1].lower()
+        return ''
+
+
+class DiffEntry:
+    """One difference found by diff_trees between two snapshots of a tree.
+
+    === Public Attributes ===
+    status:
+        One of ADDED, REMOVED, CHANGED or UNCHANGED.
+    old:
+        The tree in the old snapshot, or None if this tree was added.
+    new:
+        The tree in the new snapshot, or None if this tree was removed.
+    delta:
+        The change in data_size from <old> to <new>.
+
+    === Representation Invariants ===
+    - old is not None or new is not None
+    - if status is UNCHANGED, then delta == 0
+    """
+    status: str
+    old: Optional[TMTree]
+    new: Optional[TMTree]
+    delta: int
+
+    def __init__(self, status: str, old: Optional[TMTree],
+                 new: Optional[TMTree], delta: int) -> None:
+        """Initialize a new DiffEntry from <old> to <new>."""
+        self.status = status
+        self.old = old
+        self.new = new
+        self.delta = delta
+
+    def get_path_string(self) -> str:
+        """Return the path string of the tree this entry is about."""
+        if self.new is not None:
+            return self.new.get_path_string()
+        return self.old.get_path_string()
+
+
+# The statuses of a DiffEntry.
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+
+def diff_trees(old: TMTree, new: TMTree) -> Iterator[DiffEntry]:
+    """Yield the differences between two snapshots <old> and <new> of a tree.
+
+    Subtrees are aligned by name, starting from <old> and <new> themselves
+    whatever their names. Each aligned pair is yielded as a CHANGED entry,
+    followed by entries for its subtrees. A pair with the same data_size and
+    number of subtrees is assumed to be identical: it is yielded as a single
+    UNCHANGED entry and its subtrees are not compared. A subtree present in
+    only one snapshot is yielded as a single ADDED or REMOVED entry.
+
+    The trees are walked once with an explicit stack, and entries are
+    produced as they are found, so memory use is bounded by the depth and
+    fan-out of the trees rather than their size.
+    """
+    stack = [(old, new)]
+    visits = 0
+    try:
+        while stack:
+            old_node, new_node = stack.pop()
+            visits += 1
+            if old_node.data_size == new_node.data_size and \
+                    len(old_node._subtrees) == len(new_node._subtrees):
+                yield DiffEntry(UNCHANGED, old_node, new_node, 0)
+                continue
+            yield DiffEntry(CHANGED, old_node, new_node,
+                            new_node.data_size - old_node.data_size)
+
+            by_name = {}
+            for subtree in old_node._subtrees:
+                by_name.setdefault(subtree._name, []).append(subtree)
+            pairs = []
+            for subtree in new_node._subtrees:
+                matches = by_name.get(subtree._name)
+                if matches:
+                    pairs.append((matches.pop(0), subtree))
+                else:
+                    yield DiffEntry(ADDED, None, subtree, subtree.data_size)
+            for matches in by_name.values():
+                for subtree in matches:
+                    yield DiffEntry(REMOVED, subtree, None, -subtree.data_size)
+            stack.extend(reversed(pairs))
+    finally:
+        if tm_stats.enabled:
+            tm_stats.count('visits.diff_trees', visits)
+
+
+def set_growth_colours(entries: Iterable[DiffEntry]) -> None:
+    """Record the size changes in <entries>, as yielded by diff_trees, and
+    switch to the 'growth' colour scheme to show them on the new tree.
+
+    Entries for removed trees are not drawn, but their sizes are already
+    counted in the deltas of their parents.
+    """
+    global _growth_scale
+    _clear_growth()
+    for entry in entries:
+        if entry.new is None:
+            continue
+        _growth[entry.new] = entry.delta
+        if entry.status == ADDED:
+            _growth_added.add(entry.new)
+        _growth_scale = max(_growth_scale, abs(entry.delta))
+    _use_colour_scheme(GROWTH_SCHEME)
+
 
 if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'math', 'zlib', 'os', '__future__',
+            'tm_stats'
+        ]
+    })
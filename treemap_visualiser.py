@@ -1,7 +1,10 @@
-from typing import Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 import pygame
-from tm_trees import TMTree, FileSystemTree
-#from papers import PaperTree
+import tm_stats
+from tm_trees import TMTree, FileSystemTree, COLOUR_SCHEMES, \
+    get_colour_scheme, set_colour_scheme, diff_trees, set_growth_colours
+from papers import PaperTree, GROUPINGS
 
 
 # Screen dimensions and coordinates
@@ -11,34 +14,55 @@ WIDTH = 800  # 1024
 HEIGHT = 600  # 768
 FONT_HEIGHT = 30                       # The height of the text display.
 TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
+TREEMAP_RECT = (0, 0, WIDTH, TREEMAP_HEIGHT)  # The treemap display itself.
 
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# The file that the instrumentation statistics are written to.
+STATS_FILE = 'treemap_stats.json'
+# The phases shown, in order, in the statistics overlay.
+STATS_PHASES = ['scan', 'layout', 'hit_test', 'rects', 'draw', 'text',
+                'flip', 'frame']
 
-def run_visualisation(tree: TMTree) -> None:
+
+def run_visualisation(tree: TMTree, show_stats: bool = False) -> None:
     """Display an interactive graphical display of the given tree's treemap.
+
+    If <show_stats>, collect instrumentation statistics and show them in an
+    overlay from the start. The 'i' key toggles both collecting and showing
+    them.
     """
+    if show_stats:
+        tm_stats.enable()
 
     # Setup pygame
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
     # Render the initial display of the static treemap.
-    render_display(screen, tree, None, None)
-    tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+    render_display(screen, tree, None, None, show_stats)
+    layouts = {}
+    _show_viewport(tree, layouts)
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    event_loop(screen, tree, show_stats, layouts)
 
 
 def render_display(screen: pygame.Surface, tree: Optional[TMTree],
                    selected_node: Optional[TMTree],
-                   hover_node: Optional[TMTree]) -> None:
+                   hover_node: Optional[TMTree],
+                   show_stats: bool = False, breadcrumb: str = '') -> None:
     """Render a treemap and text display to the given screen.
 
     Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
     screen vertically into the treemap and text comments.
+
+    <tree> is the tree currently being viewed, which may be a subtree of the
+    whole tree if the display is zoomed in; <breadcrumb> then describes it,
+    and is shown before the text for <selected_node>.
+
+    If <show_stats>, draw the instrumentation overlay on top of the treemap.
     """
     # First, clear the screen
     pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
@@ -47,9 +71,12 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
     subscreen = screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
 
     # TODO: Uncomment this afer you have completed Task 2
-    for rect, colour in tree.get_rectangles():
-        # Note that the arguments are in the opposite order
-        pygame.draw.rect(subscreen, colour, rect)
+    with tm_stats.timer('rects'):
+        rectangles = tree.get_rectangles()
+    with tm_stats.timer('draw'):
+        for rect, colour in rectangles:
+            # Note that the arguments are in the opposite order
+            pygame.draw.rect(subscreen, colour, rect)
 
     # add the hover rectangle
     if selected_node is not None:
@@ -58,10 +85,38 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
         pygame.draw.rect(subscreen, (255, 255, 255), hover_node.rect, 2)
 
     # TODO: Uncomment this after you have completed Task 2
-    _render_text(screen, _get_display_text(selected_node))
+    with tm_stats.timer('text'):
+        _render_text(screen, breadcrumb + _get_display_text(selected_node))
+
+    if show_stats:
+        _render_stats(screen)
 
     # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    with tm_stats.timer('flip'):
+        pygame.display.flip()
+
+
+def _render_stats(screen: pygame.Surface) -> None:
+    """Render the instrumentation overlay at the top left of the display.
+    """
+    font = pygame.font.SysFont(FONT_FAMILY, 14)
+    lines = tm_stats.overlay_lines(STATS_PHASES)
+    if not lines:
+        lines = ['collecting statistics...']
+    surfaces = [font.render(line, 1, pygame.color.THECOLORS['white'])
+                for line in lines]
+    width = max(surface.get_width() for surface in surfaces) + 8
+    height = sum(surface.get_height() for surface in surfaces) + 8
+
+    background = pygame.Surface((width, height))
+    background.set_alpha(200)
+    background.fill(pygame.color.THECOLORS['black'])
+    screen.blit(background, ORIGIN)
+
+    y = 4
+    for surface in surfaces:
+        screen.blit(surface, (4, y))
+        y += surface.get_height()
 
 
 def _render_text(screen: pygame.Surface, text: str) -> None:
@@ -76,73 +131,169 @@ def _render_text(screen: pygame.Surface, text: str) -> None:
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
+def event_loop(screen: pygame.Surface, tree: TMTree,
+               show_stats: bool = False,
+               layouts: Optional[Dict[TMTree, List]] = None) -> None:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends only when the user closes the window.
+
+    <show_stats> is whether the instrumentation overlay is shown initially.
+
+    A paper tree can be regrouped by the next of GROUPINGS with the 'g' key.
+
+    The display can be zoomed in to the selected node, which then fills the
+    treemap display; layout, drawing and hit-testing only involve that
+    subtree. <viewports> is the stack of trees zoomed in to, starting with
+    the whole tree, and <layouts> caches the layout of each of them so that
+    zooming back out does not need to recompute it.
     """
     selected_node = None
+    viewports = [tree]
+    if layouts is None:
+        layouts = {}
 
     while True:
         # Wait for an event
         event = pygame.event.poll()
         if event.type == pygame.QUIT:
             return
+        # a frame covers everything done in response to the event
+        start = time.perf_counter()
 
         # get the hover position and the corresponding node
-        hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
+        with tm_stats.timer('hit_test'):
+            hover_node = \
+                viewports[-1].get_tree_at_position(pygame.mouse.get_pos())
 
         if event.type == pygame.MOUSEBUTTONUP:
-            selected_node = \
-                _handle_click(event.button, event.pos, tree, selected_node)
+            selected_node = _handle_click(event.button, event.pos,
+                                          viewports[-1], selected_node)
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_s:
+            _cycle_colour_scheme()
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_i:
+            show_stats = not show_stats
+            tm_stats.enable(show_stats)
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_j:
+            tm_stats.dump_json(STATS_FILE)
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_g and \
+                isinstance(tree, PaperTree):
+            tree.regroup(_next_grouping(tree.get_grouping()))
+            selected_node = None
+            viewports = [tree]
+            layouts.clear()
+            _show_viewport(tree, layouts)
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_u:
+            if len(viewports) > 1:
+                viewports.pop()
+                _show_viewport(viewports[-1], layouts)
 
         elif event.type == pygame.KEYUP and selected_node is not None:
             if event.key == pygame.K_UP:
                 #pass
                 # TODO: Uncomment once you have completed Task 4
                 selected_node.change_size(0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                _update_layout(tree, viewports[-1], layouts)
 
             elif event.key == pygame.K_DOWN:
                 #pass
                 # TODO: Uncomment once you have completed Task 4
                 selected_node.change_size(-0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                _update_layout(tree, viewports[-1], layouts)
 
             elif event.key == pygame.K_m:
                 #pass
                 # TODO: Uncomment once you have completed Task 4
                 selected_node.move(hover_node)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                _update_layout(tree, viewports[-1], layouts)
 
             elif event.key == pygame.K_e:
-                pass
-                # TODO: Uncomment once you have completed Task 5
-                # selected_node.expand()
+                selected_node.expand()
 
             elif event.key == pygame.K_a:
-                pass
-                # TODO: Uncomment once you have completed Task 5
-                # selected_node.expand_all()
+                selected_node.expand_all()
 
             elif event.key == pygame.K_c:
-                pass
-                # TODO: Uncomment once you have completed Task 5
-                # selected_node.collapse()
+                selected_node.collapse()
 
             elif event.key == pygame.K_x:
-                pass
-                # TODO: Uncomment once you have completed Task 5
-                # selected_node.collapse_all()
+                selected_node.collapse_all()
+
+            elif event.key == pygame.K_z and \
+                    selected_node is not viewports[-1]:
+                if viewports[-1] not in layouts:
+                    layouts[viewports[-1]] = viewports[-1].get_layout()
+                selected_node.expand()
+                viewports.append(selected_node)
+                _show_viewport(selected_node, layouts)
+
+            # zoom back out of anything that is no longer displayed
+            if not viewports[-1].is_expanded():
+                while len(viewports) > 1 and not viewports[-1].is_expanded():
+                    viewports.pop()
+                _show_viewport(viewports[-1], layouts)
 
         # Update display
-        render_display(screen, tree, selected_node, hover_node)
+        render_display(screen, viewports[-1], selected_node, hover_node,
+                       show_stats, _get_breadcrumb(viewports))
+        tm_stats.record_frame(time.perf_counter() - start)
+
+
+def _update_layout(tree: TMTree, viewport: TMTree,
+                   layouts: Dict[TMTree, List]) -> None:
+    """Recompute the data sizes of <tree> after it changed, and the
+    rectangles of <viewport>, the part of it being displayed.
+
+    Every layout in <layouts> is discarded, since they are now out of date.
+    """
+    with tm_stats.timer('layout'):
+        tree.update_data_sizes()
+    layouts.clear()
+    _show_viewport(viewport, layouts)
+
+
+def _show_viewport(viewport: TMTree, layouts: Dict[TMTree, List]) -> None:
+    """Lay out <viewport> to fill the treemap display, restoring its layout
+    from <layouts> if it is there, and caching it there otherwise.
+    """
+    with tm_stats.timer('layout'):
+        if viewport in layouts:
+            viewport.set_layout(layouts[viewport])
+        else:
+            viewport.update_rectangles(TREEMAP_RECT)
+            layouts[viewport] = viewport.get_layout()
+
+
+def _next_grouping(grouping: List[str]) -> List[str]:
+    """Return the first of GROUPINGS after <grouping> that differs from it,
+    starting from the first of GROUPINGS if <grouping> is not one of them.
+    """
+    if grouping in GROUPINGS:
+        i = GROUPINGS.index(grouping)
+    else:
+        i = -1
+    for step in range(1, len(GROUPINGS) + 1):
+        candidate = GROUPINGS[(i + step) % len(GROUPINGS)]
+        if candidate != grouping:
+            return candidate
+    return grouping
+
+
+def _get_breadcrumb(viewports: List[TMTree]) -> str:
+    """Return the text describing the tree zoomed in to, given the stack of
+    <viewports>, or '' if the display is not zoomed in.
+    """
+    if len(viewports) == 1:
+        return ''
+    return '[{}] '.format(viewports[-1].get_path_string(False))
 
 
 def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
@@ -169,6 +320,15 @@ def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
         return old_selected_leaf
 
 
+def _cycle_colour_scheme() -> None:
+    """Switch to the colour scheme after the active one in COLOUR_SCHEMES,
+    or to the first of them if the growth colour scheme is active.
+    """
+    scheme = get_colour_scheme()
+    i = COLOUR_SCHEMES.index(scheme) if scheme in COLOUR_SCHEMES else -1
+    set_colour_scheme(COLOUR_SCHEMES[(i + 1) % len(COLOUR_SCHEMES)])
+
+
 def _get_display_text(leaf: Optional[TMTree]) -> str:
     """Return the display text of this leaf.
     """
@@ -178,13 +338,29 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
         return leaf.get_path_string() + '  ({})'.format(leaf.data_size)
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str, show_stats: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
+    If <show_stats>, collect instrumentation statistics, including for the
+    scan of <path>, and show them in an overlay.
+
     Precondition: <path> is a valid path to a file or folder.
     """
-    file_tree = FileSystemTree(path)
-    run_visualisation(file_tree)
+    if show_stats:
+        tm_stats.enable()
+    with tm_stats.timer('scan'):
+        file_tree = FileSystemTree(path)
+    run_visualisation(file_tree, show_stats)
+
+
+def run_treemap_diff(old_tree: TMTree, new_tree: TMTree) -> None:
+    """Run a treemap visualisation of <new_tree>, coloured by how much each
+    part of it grew or shrank since the earlier snapshot <old_tree>.
+
+    Precondition: <old_tree> and <new_tree> are the same kind of tree.
+    """
+    set_growth_colours(diff_trees(old_tree, new_tree))
+    run_visualisation(new_tree)
 
 
 def run_treemap_papers() -> None:
@@ -201,7 +377,8 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers'
+            'python_ta', 'typing', 'time', 'pygame', 'tm_trees', 'papers',
+            'tm_stats'
         ],
         'generated-members': 'pygame.*'
     })